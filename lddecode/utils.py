@@ -8,7 +8,7 @@ import subprocess
 import sys
 import traceback
 
-from multiprocessing import JoinableQueue
+from queue import Queue
 import threading
 
 from numba import jit, njit
@@ -1227,15 +1227,61 @@ def jsondump_thread(ldd, outname):
                 q.task_done()
                 return
 
-            write_json(ldd, jsondict, outname)
+            if callable(jsondict):
+                # A callable defers building the dict to this thread, keeping
+                # the construction off the decode loop.
+                jsondict = jsondict()
+
+            if jsondict is not None:
+                write_json(ldd, jsondict, outname)
+
+            q.task_done()
+
+    # The consumer is a thread in this process, so use queue.Queue - the
+    # multiprocessing queues pickle their items, which the decoder's bound
+    # methods (holding locks, threads and open files) can't survive.
+    q = Queue()
+
+    # Start the self-contained thread, keeping a handle to it on the queue
+    # so callers can wait for it with a timeout on shutdown.
+    t = threading.Thread(target=consume, args=(q,))
+    t.start()
+    q.thread = t
+
+    return q
+
+
+def jsonldump_thread(outname):
+    """
+    Like jsondump_thread, but appends field dicts to a json lines sidecar
+    file instead of rewriting a whole document each time, so progress dumps
+    stay cheap no matter how many fields have been decoded.
+
+    Feed it lists of field dicts during runtime and None when done.
+    """
+
+    def consume(q):
+        fp = open(outname + ".partial.jsonl", "w")
+        while True:
+            fields = q.get()
+            if fields is None:
+                q.task_done()
+                fp.close()
+                return
+
+            for fi in fields:
+                json.dump(fi, fp, allow_nan=False, separators=(",", ":"))
+                fp.write("\n")
+            fp.flush()
 
             q.task_done()
 
-    q = JoinableQueue()
+    q = Queue()
 
     # Start the self-contained thread
     t = threading.Thread(target=consume, args=(q,))
     t.start()
+    q.thread = t
 
     return q
 
@@ -156,6 +156,115 @@ class SyncTest(unittest.TestCase):
         test_find_pulses("PAL_GOOD.txt.gz", 458)
 
 
+class BufferedChunkLoaderTest(unittest.TestCase):
+    """Tests for the buffered window loader in vhsdecode.main, run against a
+    stub loader over an in-memory sample array."""
+
+    def _make_buffered(self, data, calls, chunk=64):
+        from vhsdecode.main import BufferedChunkLoader
+
+        def loader(infile, sample, readlen):
+            calls.append((sample, readlen))
+            if sample + readlen > len(data):
+                return None
+            return data[sample : sample + readlen]
+
+        buffered = BufferedChunkLoader(loader, chunk=chunk)
+        self.addCleanup(buffered._close)
+        return buffered
+
+    def test_matches_wrapped_loader(self):
+        """Reads through the window cache - including overlapping reads,
+        window-straddling reads and backward seeks - must match the wrapped
+        loader byte for byte."""
+        data = bytes(range(256)) * 4
+        calls = []
+        buffered = self._make_buffered(data, calls)
+
+        reads = [
+            (0, 16),
+            (10, 50),
+            (60, 16),  # straddles the first window boundary
+            (63, 2),
+            (120, 40),
+            (500, 64),
+            (0, 16),  # backward seek
+            (1000, 24),  # ends exactly at EOF
+        ]
+        for sample, readlen in reads:
+            assert bytes(buffered(None, sample, readlen)) == (
+                data[sample : sample + readlen]
+            ), (sample, readlen)
+
+    def test_eof_fallback(self):
+        """Once a full window read fails near EOF, requests fall back to
+        direct reads and the failed window is not retried."""
+        data = bytes(range(100))
+        calls = []
+        buffered = self._make_buffered(data, calls)
+
+        assert bytes(buffered(None, 70, 20)) == data[70:90]
+        assert bytes(buffered(None, 80, 10)) == data[80:90]
+        # Only the first request should have attempted the full window.
+        assert calls.count((64, 64)) == 1
+        # Reading past the end still signals EOF like the wrapped loader.
+        assert buffered(None, 95, 10) is None
+
+    def test_raising_loader(self):
+        """An I/O error raised in the prefetch thread must surface on the
+        decode thread instead of wedging it."""
+        from vhsdecode.main import BufferedChunkLoader
+
+        data = bytes(range(256))
+
+        def loader(infile, sample, readlen):
+            if sample >= 64:
+                raise IOError("read error")
+            return data[sample : sample + readlen]
+
+        buffered = BufferedChunkLoader(loader, chunk=64)
+        self.addCleanup(buffered._close)
+
+        assert bytes(buffered(None, 0, 16)) == data[0:16]
+        # Wait for the prefetch of the next window to fail in the thread.
+        assert buffered._have_next.wait(timeout=10)
+        with self.assertRaises(IOError):
+            buffered(None, 64, 16)
+
+
+class JsonDumpThreadTest(unittest.TestCase):
+    def test_callable_payload(self):
+        """Check that the dump queue handles the payloads main() feeds it:
+        a bound method of the decoder, which holds locks and open files and
+        therefore must never be pickled by the queue."""
+        import json
+        import os
+        import tempfile
+        import threading
+
+        import lddecode.utils as lddu
+
+        class FakeDecoder:
+            verboseVITS = False
+
+            def __init__(self):
+                self.lock = threading.Lock()
+
+            def build_json(self):
+                return {"fields": []}
+
+        ldd = FakeDecoder()
+        outname = os.path.join(tempfile.mkdtemp(), "dumptest")
+
+        q = lddu.jsondump_thread(ldd, outname)
+        q.put(ldd.build_json)
+        q.put(None)
+        q.join()
+
+        with open(outname + ".tbc.json") as fp:
+            assert json.load(fp) == {"fields": []}
+
+
 class ZCTest(unittest.TestCase):
     def test_calczc(self):
         data = np.array([8.0, 4.0, 1.0, 8.0, 1.0, 4.0, 8.0])
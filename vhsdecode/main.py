@@ -1,7 +1,11 @@
 import argparse
+import functools
+import logging
+import logging.handlers
 import os
 import sys
 import signal
+import threading
 import traceback
 import time
 
@@ -27,7 +31,9 @@ from vhsdecode.cmdcommons import (
     test_input_file,
     test_output_file,
 )
+import vhsdecode.formats as formats
 from vhsdecode.formats import TAPE_SPEEDS
+from vhsdecode.debug_plot import DebugPlot
 
 supported_tape_formats = {
     "VHS",
@@ -47,9 +53,166 @@ supported_tape_formats = {
 }
 
 
-def main(args=None, use_gui=False):
-    import vhsdecode.formats as f
-
+class BufferedChunkLoader:
+    """Wrap a plain file loader function and serve reads from a large cached window.
+
+    The decoder requests samples in lots of small, partly overlapping reads,
+    and on network shares or spinning disks the per-read overhead from those
+    can end up dominating the decode time. This reads the input in large
+    aligned windows instead and hands out views into the cached window.
+
+    Only meant for the plain file loader functions - the ffmpeg/ld-ldf-reader
+    based loaders read from a pipe and keep their own buffering.
+
+    A background thread reads the window following the current one while the
+    decoder works, so sequential decodes rarely have to wait for I/O at all.
+    """
+
+    def __init__(self, loader, chunk=32 << 20):
+        # Note: chunk is in samples, not bytes.
+        self.loader = loader
+        self.chunk = chunk
+        self._window_start = 0
+        self._window = None
+        self._advised = False
+        # Earliest window start known to be too close to EOF for a full
+        # window, so the tail isn't pointlessly re-read on every request.
+        self._short_from = None
+
+        # Prefetch state. The reader thread fills _next_window with the
+        # window requested via _wanted; all calls into the wrapped loader are
+        # serialized with _io_lock since the loaders seek the shared file.
+        self._infile = None
+        self._io_lock = threading.Lock()
+        self._wanted = None
+        self._next_start = None
+        self._next_window = None
+        self._next_error = None
+        self._have_next = threading.Event()
+        self._wakeup = threading.Event()
+        self._stop = False
+        self._thread = threading.Thread(target=self._reader_thread, daemon=True)
+        self._thread.start()
+
+    def _reader_thread(self):
+        """Read requested windows into the spare buffer as they come in."""
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if self._stop:
+                return
+            start = self._wanted
+            if start is None:
+                continue
+            window = None
+            error = None
+            try:
+                with self._io_lock:
+                    window = self.loader(self._infile, start, self.chunk)
+            except Exception as e:
+                # Loaders may propagate I/O errors; hand them over to the
+                # decode thread rather than dying here, which would leave it
+                # waiting on _have_next forever.
+                error = e
+            if window is None and error is None:
+                self._note_short_window(start)
+            self._next_start = start
+            self._next_window = window
+            self._next_error = error
+            self._have_next.set()
+
+    def _request_prefetch(self, start):
+        if self._short_from is not None and start >= self._short_from:
+            # A full window there failed before, don't bother.
+            return
+        self._have_next.clear()
+        self._next_window = None
+        self._wanted = start
+        self._wakeup.set()
+
+    def _note_short_window(self, start):
+        """Remember where full window reads start failing near EOF."""
+        if self._short_from is None or start < self._short_from:
+            self._short_from = start
+
+    def _close(self):
+        """Stop the prefetch thread. Called by DemodCache.end on shutdown."""
+        self._stop = True
+        self._wakeup.set()
+        self._thread.join()
+        if hasattr(self.loader, "_close") and callable(self.loader._close):
+            self.loader._close()
+
+    def _advise_sequential(self, infile):
+        """Hint the OS that the input will mostly be read sequentially."""
+        if hasattr(os, "posix_fadvise"):
+            try:
+                os.posix_fadvise(infile.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            except (OSError, AttributeError):
+                # Not a plain file, so nothing to hint.
+                pass
+        self._advised = True
+
+    def __call__(self, infile, sample, readlen):
+        self._infile = infile
+        if not self._advised:
+            self._advise_sequential(infile)
+
+        if readlen > self.chunk:
+            with self._io_lock:
+                return self.loader(infile, sample, readlen)
+
+        end = sample + readlen
+        if (
+            self._window is None
+            or sample < self._window_start
+            or end > self._window_start + len(self._window)
+        ):
+            start = (sample // self.chunk) * self.chunk
+            if end > start + self.chunk:
+                # The request straddles a window boundary, so align the new
+                # window to the request instead.
+                start = sample
+
+            window = None
+            if self._wanted == start:
+                # The reader thread has (or is working on) this window.
+                self._have_next.wait()
+                if self._next_start == start:
+                    if self._next_error is not None:
+                        # Re-raise on this thread so the decode loop's error
+                        # handling sees it, like a direct loader call would.
+                        error = self._next_error
+                        self._next_error = None
+                        raise error
+                    window = self._next_window
+            if window is None and (
+                self._short_from is None or start < self._short_from
+            ):
+                with self._io_lock:
+                    window = self.loader(infile, start, self.chunk)
+                if window is None:
+                    self._note_short_window(start)
+            if window is None:
+                # Not enough data left for a full window, let the wrapped
+                # loader deal with the remainder directly.
+                with self._io_lock:
+                    return self.loader(infile, sample, readlen)
+            self._window_start = start
+            self._window = window
+            self._request_prefetch(start + self.chunk)
+
+        offset = sample - self._window_start
+        return self._window[offset : offset + readlen]
+
+
+@functools.lru_cache(maxsize=2)
+def _build_parser(use_gui):
+    """Build the argument parser.
+
+    Cached so repeated invocations in the same process don't redo the ~20
+    add_argument calls and their help strings.
+    """
     parser, debug_group = common_parser(
         "Extracts video from RAW RF captures of colour-under & composite modulated tapes",
         use_gui=use_gui,
@@ -309,10 +472,15 @@ def main(args=None, use_gui=False):
         dest="dod_hysteresis",
         metavar="value",
         type=float,
-        default=f.DEFAULT_HYSTERESIS,
+        default=formats.DEFAULT_HYSTERESIS,
         help="Dropout detection hysteresis, the rf level needs to go above the dropout threshold multiplied by this for a dropout to end.",
     )
 
+    return parser
+
+
+def main(args=None, use_gui=False):
+    parser = _build_parser(use_gui)
     args = parser.parse_args(args)
 
     try:
@@ -333,7 +501,7 @@ def main(args=None, use_gui=False):
         sys.exit(1)
 
     if not args.overwrite:
-        conflicts_ext = [".tbc", "_chroma.tbc", ".log", ".tbc.json"]
+        conflicts_ext = [".tbc", "_chroma.tbc", ".log", ".tbc.json", ".partial.jsonl"]
         conflicts = []
 
         for ext in conflicts_ext:
@@ -371,50 +539,74 @@ def main(args=None, use_gui=False):
     if loader is lddu.load_packed_data_4_40 and not filename.endswith(".lds"):
         loader = lddu.LoadFFmpeg()
 
-    dod_threshold_p = f.DEFAULT_THRESHOLD_P_DDD
+    # Serve the decoder's many small reads from large cached windows when
+    # reading from a plain file to cut down on read call overhead.
+    if not isinstance(loader, (lddu.LoadFFmpeg, lddu.LoadLDF)):
+        loader = BufferedChunkLoader(loader)
+
+    dod_threshold_p = formats.DEFAULT_THRESHOLD_P_DDD
     if args.cxadc or args.cxadc3 or args.cxadc_tenbit or args.cxadc3_tenbit:
-        dod_threshold_p = f.DEFAULT_THRESHOLD_P_CXADC
-
-    rf_options = get_rf_options(args)
-    rf_options["dod_threshold_p"] = dod_threshold_p
-    rf_options["dod_threshold_a"] = args.dod_threshold_a
-    rf_options["dod_hysteresis"] = args.dod_hysteresis
-    rf_options["track_phase"] = args.track_phase
-    rf_options["recheck_phase"] = args.recheck_phase
-    rf_options["high_boost"] = args.high_boost
-    rf_options["disable_diff_demod"] = args.disable_diff_demod
-    rf_options["fm_audio_notch"] = args.fm_audio_notch
-    rf_options["disable_dc_offset"] = not args.enable_dc_offset
-    rf_options["disable_comb"] = args.disable_comb
-    rf_options["skip_chroma"] = args.skip_chroma
-    rf_options["nldeemp"] = args.nldeemp
-    rf_options["subdeemp"] = args.subdeemp
-    rf_options["y_comb"] = args.y_comb
-    rf_options["cafc"] = args.cafc
-    rf_options["disable_right_hsync"] = args.disable_right_hsync
-    rf_options["level_detect_divisor"] = args.level_detect_divisor
-    rf_options["fallback_vsync"] = args.fallback_vsync
-    rf_options["saved_levels"] = args.saved_levels
-    rf_options["skip_hsync_refine"] = args.skip_hsync_refine
-    rf_options["export_raw_tbc"] = args.export_raw_tbc
-    rf_options["tape_speed"] = args.tape_speed
-    rf_options["ire0_adjust"] = args.ire0_adjust
+        dod_threshold_p = formats.DEFAULT_THRESHOLD_P_CXADC
+
+    rf_options = {
+        **get_rf_options(args),
+        "dod_threshold_p": dod_threshold_p,
+        "dod_threshold_a": args.dod_threshold_a,
+        "dod_hysteresis": args.dod_hysteresis,
+        "track_phase": args.track_phase,
+        "recheck_phase": args.recheck_phase,
+        "high_boost": args.high_boost,
+        "disable_diff_demod": args.disable_diff_demod,
+        "fm_audio_notch": args.fm_audio_notch,
+        "disable_dc_offset": not args.enable_dc_offset,
+        "disable_comb": args.disable_comb,
+        "skip_chroma": args.skip_chroma,
+        "nldeemp": args.nldeemp,
+        "subdeemp": args.subdeemp,
+        "y_comb": args.y_comb,
+        "cafc": args.cafc,
+        "disable_right_hsync": args.disable_right_hsync,
+        "level_detect_divisor": args.level_detect_divisor,
+        "fallback_vsync": args.fallback_vsync,
+        "saved_levels": args.saved_levels,
+        "skip_hsync_refine": args.skip_hsync_refine,
+        "export_raw_tbc": args.export_raw_tbc,
+        "tape_speed": args.tape_speed,
+        "ire0_adjust": args.ire0_adjust,
+    }
 
     extra_options = get_extra_options(args, not use_gui)
     extra_options["params_file"] = args.params_file
 
     # Wrap the LDdecode creation so that the signal handler is not taken by sub-threads,
-    # allowing SIGINT/control-C's to be handled cleanly
-    original_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # allowing SIGINT/control-C's to be handled cleanly.
+    # Threads inherit the signal mask of the thread that creates them, so
+    # blocking SIGINT here keeps it away from the workers for good without
+    # having to swap handlers. pthread_sigmask doesn't exist on windows so
+    # fall back to toggling the handler there.
+    if hasattr(signal, "pthread_sigmask"):
+        original_sigmask = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGINT})
+        original_sigint_handler = None
+    else:
+        original_sigmask = None
+        original_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
 
     logger = init_logging(outname + ".log")
 
+    # Batch logfile records in memory and write them out in bursts instead
+    # of interleaving a write+flush per record with the decode loop. Errors
+    # flush straight away, and cleanup() runs logging.shutdown() which
+    # flushes the remainder before exit.
+    for i, handler in enumerate(logger.handlers):
+        if isinstance(handler, logging.FileHandler):
+            logger.handlers[i] = logging.handlers.MemoryHandler(
+                512, flushLevel=logging.ERROR, target=handler
+            )
+
     if not use_gui and args.umatic:
         tape_format = "UMATIC"
     else:
         tape_format = args.tape_format.upper()
-    if tape_format not in supported_tape_formats:
-        logger.warning("Tape format %s not supported! Defaulting to VHS", tape_format)
 
     if not use_gui and args.dodod:
         logger.warning(
@@ -423,10 +615,25 @@ def main(args=None, use_gui=False):
 
     debug_plot = None
     if args.debug_plot:
-        from vhsdecode.debug_plot import DebugPlot
-
         debug_plot = DebugPlot(args.debug_plot)
 
+    num_threads = args.threads if not debug_plot else 0
+
+    # Pin the process to a subset of its allowed cores where supported,
+    # before the decoder spawns its worker threads so they inherit the mask.
+    # This keeps the workers from migrating between cores mid-decode, which
+    # helps cache locality on the filter/fft heavy parts. The subset is
+    # taken from the current affinity mask so external pinning (taskset,
+    # cgroups) is respected and concurrent decodes given different masks
+    # don't all pile onto the same cores. May be denied in restricted
+    # containers, so just skip it if it fails.
+    if hasattr(os, "sched_setaffinity") and num_threads:
+        try:
+            allowed = sorted(os.sched_getaffinity(0))
+            os.sched_setaffinity(0, set(allowed[: num_threads + 1]))
+        except OSError:
+            pass
+
     # Initialize VHS decoder
     # Note, we pass 40 as sample frequency, as any other will be resampled by the
     # loader function.
@@ -438,7 +645,7 @@ def main(args=None, use_gui=False):
         system=system,
         tape_format=tape_format,
         doDOD=not args.nodod,
-        threads=args.threads if not debug_plot else 0,
+        threads=num_threads,
         inputfreq=sample_freq,
         level_adjust=args.level_adjust,
         rf_options=rf_options,
@@ -446,7 +653,10 @@ def main(args=None, use_gui=False):
         debug_plot=debug_plot,
     )
 
-    signal.signal(signal.SIGINT, original_sigint_handler)
+    if original_sigmask is not None:
+        signal.pthread_sigmask(signal.SIG_SETMASK, original_sigmask)
+    else:
+        signal.signal(signal.SIGINT, original_sigint_handler)
 
     if args.start_fileloc != -1:
         vhsd.roughseek(args.start_fileloc, False)
@@ -459,11 +669,29 @@ def main(args=None, use_gui=False):
     done = False
 
     jsondumper = lddu.jsondump_thread(vhsd, outname)
+    jsondumper_incremental = lddu.jsonldump_thread(outname)
 
     def cleanup():
-        jsondumper.put(vhsd.build_json())
+        jsondumper.put(vhsd.build_json)
         vhsd.close()
         jsondumper.put(None)
+        jsondumper_incremental.put(None)
+        # Wait for the dumper threads (not their queues - a consumer that
+        # died mid-item would leave a queue join() stuck forever) so the
+        # output is on disk before the exits below skip the normal
+        # interpreter teardown. The final .tbc.json must never be cut short,
+        # so that join is untimed - a dead thread still joins immediately;
+        # only the disposable progress sidecar gets a bounded wait.
+        jsondumper.thread.join()
+        jsondumper_incremental.thread.join(timeout=10)
+        # The sidecar is superseded by the complete .tbc.json at this point,
+        # so don't leave it behind.
+        if os.path.isfile(outname + ".tbc.json"):
+            try:
+                os.remove(outname + ".partial.jsonl")
+            except OSError:
+                pass
+        logging.shutdown()
 
     # TODO: Put the stuff below this in a function so we can re-use for both vhs and cvbs
 
@@ -471,15 +699,23 @@ def main(args=None, use_gui=False):
     firstdecode = time.time()
     seconddecode = None
 
-    while not done and vhsd.fields_written < (req_frames * 2):
+    last_json_fields = 0
+    req_fields = req_frames * 2
+
+    # Read several fields per iteration to amortize the per-field python
+    # overhead in this loop; the batch is capped so we don't decode past the
+    # requested number of frames.
+    while not done and vhsd.fields_written < req_fields:
         try:
-            f = vhsd.readfield()
+            fields = vhsd.readfields(min(8, req_fields - vhsd.fields_written))
             if not seconddecode:
                 seconddecode = time.time()
         except KeyboardInterrupt:
             print("Terminated, saving JSON and exiting")
             cleanup()
-            sys.exit(1)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(1)
         except Exception as err:
             print(
                 "\nERROR - please paste the following into a bug report:",
@@ -490,15 +726,24 @@ def main(args=None, use_gui=False):
             print("Exception:", err, " Traceback:", file=sys.stderr)
             traceback.print_tb(err.__traceback__)
             cleanup()
-            sys.exit(1)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(1)
 
-        if f is None:
+        # readfields cuts the prevfield links itself; a trailing None means
+        # the end of the input was reached.
+        if fields and fields[-1] is None:
             done = True
-        else:
-            f.prevfield = None
 
-        if vhsd.fields_written < 100 or ((vhsd.fields_written % 500) == 0):
-            jsondumper.put(vhsd.build_json())
+        # The low early threshold is just there so progress is visible
+        # quickly after startup, no need to keep dumping for 100 fields.
+        if vhsd.fields_written <= 8 or (vhsd.fields_written // 500) != (
+            last_json_fields // 500
+        ):
+            # Append just the new fields to the progress sidecar; the full
+            # json document is only built once in cleanup().
+            jsondumper_incremental.put(vhsd.build_json_delta(last_json_fields))
+            last_json_fields = vhsd.fields_written
 
     if vhsd.fields_written:
         timeused = time.time() - firstdecode
@@ -514,4 +759,9 @@ def main(args=None, use_gui=False):
         print(f"\nCompleted without handling any frames.", file=sys.stderr)
 
     cleanup()
-    sys.exit(0)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    # Everything is flushed at this point, so exit without running atexit
+    # hooks or garbage collecting the decoder's large buffers - the regular
+    # interpreter teardown can take seconds after a long decode.
+    os._exit(0)
@@ -308,6 +308,28 @@ class VHSDecode(ldd.LDdecode):
             print("Cannot build json: %s" % e)
             return None
 
+    def build_json_delta(self, last_field_idx):
+        """Return the field info dicts added since last_field_idx."""
+        return self.fieldinfo[last_field_idx:]
+
+    def readfields(self, count, initphase=False):
+        """Read and process up to count fields in one call.
+
+        Returns a list of the decoded fields; a None entry marks the end of
+        the input and is always last.
+        """
+        fields = []
+        for _ in range(count):
+            f = self.readfield(initphase)
+            fields.append(f)
+            if f is None:
+                break
+            # Cut the link to the previous field right away so the batch
+            # doesn't keep a chain of decoded fields alive until the caller
+            # gets around to it.
+            f.prevfield = None
+        return fields
+
     def readfield(self, initphase=False):
         done = False
         adjusted = False